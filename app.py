@@ -4,12 +4,23 @@ import PyPDF2
 import re
 import os
 import sys
-import difflib
 import logging
+import hashlib
+import json
+import time
+import argparse
+import threading
+import sqlite3
+from contextlib import closing
+from collections import OrderedDict, Counter
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+from pickle import PicklingError
 from datetime import datetime
 from pathlib import Path
 import tempfile
 import io
+import comparacion
 
 # Configuración de la página
 st.set_page_config(
@@ -83,20 +94,145 @@ st.markdown("""
 st.markdown("<h1 class='main-header'>Comparador de Muestras</h1>", unsafe_allow_html=True)
 st.markdown("<div class='info-box'>Esta aplicación compara muestras entre un archivo Excel y un PDF de factura, identificando discrepancias y generando un informe detallado.</div>", unsafe_allow_html=True)
 
+def _rebobinar(archivo):
+    """
+    Vuelve al inicio un archivo cargado para poder leerlo de nuevo.
+    
+    Args:
+        archivo: Archivo cargado o ruta (las rutas se ignoran)
+    """
+    if hasattr(archivo, 'seek'):
+        archivo.seek(0)
+
+# Caché de páginas de PDF
+class CachePaginasPDF:
+    """Caché de texto extraído y muestras analizadas por página de PDF."""
+    
+    def __init__(self, directorio=None, max_entradas=20000):
+        """
+        Inicializa la caché.
+        
+        Args:
+            directorio (str): Carpeta opcional donde persistir las entradas entre procesos
+            max_entradas (int): Número máximo de entradas mantenidas en memoria
+        """
+        self.directorio = Path(directorio) if directorio else None
+        self.max_entradas = max_entradas
+        self._memoria = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def _ruta(self, tipo, clave):
+        return self.directorio / tipo / clave[:2] / f"{clave}.json"
+    
+    def obtener(self, tipo, clave):
+        """
+        Devuelve una entrada de la caché.
+        
+        Args:
+            tipo (str): Tipo de entrada ('texto' o 'muestras')
+            clave (str): Hash que identifica la entrada
+        
+        Returns:
+            Valor almacenado, o None si no está en la caché
+        """
+        with self._lock:
+            if (tipo, clave) in self._memoria:
+                self._memoria.move_to_end((tipo, clave))
+                return self._memoria[(tipo, clave)]
+        
+        if self.directorio is None:
+            return None
+        ruta = self._ruta(tipo, clave)
+        try:
+            with open(ruta, encoding='utf-8') as f:
+                valor = json.load(f)
+        except (OSError, ValueError):
+            return None
+        try:
+            # La fecha de modificación marca el último uso, para limpiar_disco
+            os.utime(ruta)
+        except OSError:
+            pass
+        self._guardar_memoria(tipo, clave, valor)
+        return valor
+    
+    def guardar(self, tipo, clave, valor):
+        """
+        Guarda una entrada en la caché.
+        
+        Args:
+            tipo (str): Tipo de entrada ('texto' o 'muestras')
+            clave (str): Hash que identifica la entrada
+            valor: Valor serializable a JSON
+        """
+        self._guardar_memoria(tipo, clave, valor)
+        if self.directorio is not None:
+            ruta = self._ruta(tipo, clave)
+            ruta.parent.mkdir(parents=True, exist_ok=True)
+            _escribir_json_atomico(ruta, valor)
+    
+    def _guardar_memoria(self, tipo, clave, valor):
+        with self._lock:
+            self._memoria[(tipo, clave)] = valor
+            self._memoria.move_to_end((tipo, clave))
+            while len(self._memoria) > self.max_entradas:
+                self._memoria.popitem(last=False)
+    
+    def limpiar_disco(self, max_dias):
+        """
+        Elimina del disco las entradas que no se han usado en los últimos días.
+        
+        Args:
+            max_dias (float): Antigüedad máxima, en días, desde el último uso
+        
+        Returns:
+            int: Número de archivos eliminados
+        """
+        if self.directorio is None or not self.directorio.exists():
+            return 0
+        limite = time.time() - max_dias * 86400
+        eliminados = 0
+        for ruta in self.directorio.rglob('*.json*'):
+            try:
+                if ruta.is_file() and ruta.stat().st_mtime < limite:
+                    ruta.unlink()
+                    eliminados += 1
+            except OSError:
+                # Otro proceso la ha usado o eliminado a la vez
+                continue
+        return eliminados
+
 # Clase para el comparador de muestras
 class ComparadorMuestras:
     """Clase principal para comparar muestras entre Excel y PDF."""
     
-    def __init__(self, excel_file, pdf_file):
+    # Patrones para identificar códigos de muestra y análisis
+    PATRON_MUESTRA = r'(\d{8})'  # Patrón para códigos de muestra (8 dígitos)
+    PATRON_CODI_EIX = r'(M-\d{2}-\d{4})'  # Patrón para códigos Eix (M-XX-XXXX)
+    
+    # Normalización de nombres de columnas del Excel
+    MAPEO_COLUMNAS = {
+        'Ref.': 'ref',
+        'Instal·lació': 'instalacion',
+        'Procedència': 'procedencia',
+        'Mostra': 'muestra',
+        'Codi Eix': 'codiEix',
+        'Anàlisis': 'analisis'
+    }
+    COLUMNAS_REQUERIDAS = ['muestra', 'codiEix', 'analisis']
+    
+    def __init__(self, excel_file, pdf_file, cache_paginas=None):
         """
         Inicializa el comparador con los archivos.
         
         Args:
             excel_file: Archivo Excel cargado
             pdf_file: Archivo PDF cargado
+            cache_paginas (CachePaginasPDF): Caché opcional de texto y muestras por página
         """
         self.excel_file = excel_file
         self.pdf_file = pdf_file
+        self.cache_paginas = cache_paginas
         
         # Inicializar variables para almacenar datos
         self.excel_data = None
@@ -125,11 +261,7 @@ class ComparadorMuestras:
             df = pd.read_excel(xls, sheet_name=sheet_name)
             
             # Buscar la fila de encabezados (normalmente entre las filas 1-5)
-            header_row = None
-            for i in range(5):
-                if 'Ref.' in df.iloc[i].values or 'Mostra' in df.iloc[i].values:
-                    header_row = i
-                    break
+            header_row = self._buscar_fila_encabezados(df)
             
             if header_row is None:
                 st.error("No se encontró la fila de encabezados en el Excel")
@@ -139,24 +271,13 @@ class ComparadorMuestras:
             df.columns = df.iloc[header_row]
             df = df.iloc[header_row+1:].reset_index(drop=True)
             
-            # Normalizar nombres de columnas
-            column_mapping = {
-                'Ref.': 'ref',
-                'Instal·lació': 'instalacion',
-                'Procedència': 'procedencia',
-                'Mostra': 'muestra',
-                'Codi Eix': 'codiEix',
-                'Anàlisis': 'analisis'
-            }
-            
             # Renombrar columnas si existen
-            for old_name, new_name in column_mapping.items():
+            for old_name, new_name in self.MAPEO_COLUMNAS.items():
                 if old_name in df.columns:
                     df = df.rename(columns={old_name: new_name})
             
             # Verificar que tenemos las columnas necesarias
-            required_columns = ['muestra', 'codiEix', 'analisis']
-            for col in required_columns:
+            for col in self.COLUMNAS_REQUERIDAS:
                 if col not in df.columns:
                     st.error(f"Columna requerida '{col}' no encontrada en el Excel")
                     return False
@@ -179,6 +300,76 @@ class ComparadorMuestras:
             st.error(f"Error al procesar el archivo Excel: {str(e)}")
             return False
     
+    def _buscar_fila_encabezados(self, df):
+        """
+        Busca la fila de encabezados entre las primeras filas del Excel.
+        
+        Args:
+            df (DataFrame): Hoja leída con pandas
+        
+        Returns:
+            int: Índice de la fila de encabezados, o None si no se encuentra
+        """
+        for i in range(5):
+            if 'Ref.' in df.iloc[i].values or 'Mostra' in df.iloc[i].values:
+                return i
+        return None
+    
+    def validar_preflight(self, max_paginas=2):
+        """
+        Validación rápida de los archivos antes del procesamiento completo.
+        Lee solo las primeras filas de la hoja y las primeras páginas del PDF.
+        
+        Args:
+            max_paginas (int): Número de páginas del PDF a revisar
+        
+        Returns:
+            dict: Veredicto con las claves 'valido', 'errores' y 'tiempo' (segundos)
+        """
+        inicio = time.perf_counter()
+        errores = []
+        
+        # Excel: cabecera entre las primeras filas y columnas requeridas
+        try:
+            _rebobinar(self.excel_file)
+            df = pd.read_excel(self.excel_file, sheet_name=0, nrows=5)
+            header_row = self._buscar_fila_encabezados(df)
+            if header_row is None:
+                errores.append("No se encontró la fila de encabezados en el Excel")
+            else:
+                encabezados = {self.MAPEO_COLUMNAS.get(v, v) for v in df.iloc[header_row].values}
+                for col in self.COLUMNAS_REQUERIDAS:
+                    if col not in encabezados:
+                        errores.append(f"Columna requerida '{col}' no encontrada en el Excel")
+        except Exception as e:
+            errores.append(f"Error al leer el archivo Excel: {str(e)}")
+        finally:
+            _rebobinar(self.excel_file)
+        
+        # PDF: códigos de muestra y códigos Eix en las primeras páginas
+        try:
+            _rebobinar(self.pdf_file)
+            pdf_reader = PyPDF2.PdfReader(self.pdf_file)
+            memo = {}
+            texto = "\n".join(self._texto_pagina(page, memo)[1] for page in pdf_reader.pages[:max_paginas])
+            if not texto.strip():
+                errores.append("No se pudo extraer texto del PDF")
+            else:
+                if not re.search(self.PATRON_MUESTRA, texto):
+                    errores.append("No se encontraron códigos de muestra en las primeras páginas del PDF")
+                if not re.search(self.PATRON_CODI_EIX, texto):
+                    errores.append("No se encontraron códigos Eix en las primeras páginas del PDF")
+        except Exception as e:
+            errores.append(f"Error al leer el archivo PDF: {str(e)}")
+        finally:
+            _rebobinar(self.pdf_file)
+        
+        return {
+            'valido': not errores,
+            'errores': errores,
+            'tiempo': round(time.perf_counter() - inicio, 4)
+        }
+    
     def procesar_pdf(self):
         """
         Procesa el archivo PDF para extraer información de muestras.
@@ -187,14 +378,22 @@ class ComparadorMuestras:
             bool: True si el procesamiento fue exitoso, False en caso contrario
         """
         try:
-            # Extraer texto del PDF
-            pdf_text = self._extraer_texto_pdf()
-            if not pdf_text:
-                st.error("No se pudo extraer texto del PDF")
-                return False
-            
-            # Extraer muestras del texto del PDF
-            muestras = self._extraer_muestras_pdf(pdf_text)
+            if self.cache_paginas is not None:
+                # Extraer texto y muestras por página, reutilizando las páginas sin cambios
+                paginas = self._extraer_paginas_pdf()
+                if not paginas:
+                    st.error("No se pudo extraer texto del PDF")
+                    return False
+                muestras = self._extraer_muestras_paginas(paginas)
+            else:
+                # Extraer texto del PDF
+                pdf_text = self._extraer_texto_pdf()
+                if not pdf_text:
+                    st.error("No se pudo extraer texto del PDF")
+                    return False
+                
+                # Extraer muestras del texto del PDF
+                muestras = self._extraer_muestras_pdf(pdf_text)
             
             if not muestras:
                 st.error("No se encontraron muestras en el PDF")
@@ -216,16 +415,155 @@ class ComparadorMuestras:
             str: Texto extraído del PDF
         """
         try:
-            text = ""
-            pdf_reader = PyPDF2.PdfReader(self.pdf_file)
-            for page_num in range(len(pdf_reader.pages)):
-                page = pdf_reader.pages[page_num]
-                text += page.extract_text() + "\n"
-            return text
+            return "".join(texto + "\n" for _, texto in self._extraer_paginas_pdf())
         except Exception as e:
             st.error(f"Error al extraer texto del PDF: {str(e)}")
             return ""
     
+    def _extraer_paginas_pdf(self):
+        """
+        Extrae el texto de cada página del PDF. Si hay caché de páginas, solo
+        se decodifican las páginas cuyo flujo de contenido no se ha visto antes.
+        
+        Returns:
+            list: Lista de tuplas (hash del contenido o None, texto de la página)
+        """
+        pdf_reader = PyPDF2.PdfReader(self.pdf_file)
+        memo = {}
+        return [self._texto_pagina(page, memo) for page in pdf_reader.pages]
+    
+    def _texto_pagina(self, page, memo=None):
+        """
+        Extrae el texto de una página, consultando antes la caché de páginas.
+        
+        Args:
+            page (PageObject): Página del PDF
+            memo (dict): Hashes ya calculados de objetos del mismo documento
+        
+        Returns:
+            tuple: (hash del contenido o None, texto de la página)
+        """
+        if self.cache_paginas is None:
+            return None, page.extract_text()
+        
+        try:
+            hash_pagina = self._hash_contenido_pagina(page, {} if memo is None else memo)
+        except Exception:
+            # Un problema con la clave de caché nunca debe impedir la extracción
+            return None, page.extract_text()
+        
+        texto = self.cache_paginas.obtener('texto', hash_pagina)
+        if texto is None:
+            texto = page.extract_text()
+            self.cache_paginas.guardar('texto', hash_pagina, texto)
+        return hash_pagina, texto
+    
+    def _hash_contenido_pagina(self, page, memo):
+        """
+        Calcula el hash de una página a partir de su flujo de contenido y de sus
+        recursos. El /Contents puede ser un único flujo o un array de flujos
+        (habitual en PDF generados o sellados), y el texto puede dibujarse desde
+        Form XObjects o depender de las fuentes y sus mapas ToUnicode, por lo que
+        los recursos se incluyen resueltos.
+        
+        Args:
+            page (PageObject): Página del PDF
+            memo (dict): Hashes ya calculados de objetos del mismo documento
+        
+        Returns:
+            str: Hash hexadecimal del contenido
+        """
+        h = hashlib.sha256()
+        contenido = page.get_contents()
+        if isinstance(contenido, PyPDF2.generic.ArrayObject):
+            for flujo in contenido:
+                h.update(flujo.get_object().get_data())
+        elif contenido is not None:
+            h.update(contenido.get_data())
+        h.update(b'\x00recursos:')
+        h.update(self._hash_objeto_pdf(dict.get(page, '/Resources'), memo).encode('ascii'))
+        return h.hexdigest()
+    
+    # Claves que no influyen en el texto extraído (programas de fuente, longitudes
+    # y filtros de compresión) o que llevarían a recorrer el árbol de páginas
+    CLAVES_SIN_HASH = {'/Length', '/Filter', '/DecodeParms', '/FontFile', '/FontFile2', '/FontFile3', '/Parent'}
+    
+    def _hash_objeto_pdf(self, obj, memo):
+        """
+        Hash recursivo de un objeto PDF: diccionarios, arrays, flujos y los
+        objetos indirectos a los que hacen referencia.
+        
+        Args:
+            obj: Objeto PDF (directo o referencia indirecta)
+            memo (dict): Hashes ya calculados de objetos indirectos, por (idnum, generación)
+        
+        Returns:
+            str: Hash hexadecimal del objeto
+        """
+        if isinstance(obj, PyPDF2.generic.IndirectObject):
+            clave = (obj.idnum, obj.generation)
+            if clave not in memo:
+                # Marcador provisional para cortar referencias circulares
+                memo[clave] = f"ref:{obj.idnum}:{obj.generation}"
+                memo[clave] = self._hash_objeto_pdf(obj.get_object(), memo)
+            return memo[clave]
+        
+        h = hashlib.sha256()
+        if isinstance(obj, PyPDF2.generic.DictionaryObject):
+            h.update(b'd')
+            for clave in sorted(obj):
+                if clave in self.CLAVES_SIN_HASH:
+                    continue
+                h.update(str(clave).encode('utf-8'))
+                h.update(self._hash_objeto_pdf(dict.__getitem__(obj, clave), memo).encode('ascii'))
+            if isinstance(obj, PyPDF2.generic.StreamObject):
+                h.update(b's')
+                h.update(obj.get_data())
+        elif isinstance(obj, PyPDF2.generic.ArrayObject):
+            h.update(b'a')
+            for elemento in obj:
+                h.update(self._hash_objeto_pdf(elemento, memo).encode('ascii'))
+        else:
+            h.update(repr(obj).encode('utf-8'))
+        return h.hexdigest()
+    
+    def _extraer_muestras_paginas(self, paginas):
+        """
+        Extrae las muestras página a página, reutilizando los registros ya
+        analizados de las páginas cuyo texto (y el de su contexto) no ha cambiado.
+        
+        Args:
+            paginas (list): Lista de tuplas (hash del contenido, texto) de _extraer_paginas_pdf
+        
+        Returns:
+            list: Lista de diccionarios con información de muestras
+        """
+        # Mismas líneas que produce split('\n') sobre el texto completo
+        lineas = []
+        rangos = []
+        for _, texto in paginas:
+            partes = texto.split('\n')
+            rangos.append((len(lineas), len(lineas) + len(partes)))
+            lineas.extend(partes)
+        lineas.append('')
+        
+        muestras = []
+        for inicio, fin in rangos:
+            # El análisis de una línea consulta hasta 3 líneas anteriores y 1 posterior,
+            # que pueden pertenecer a las páginas vecinas
+            inicio_contexto = max(0, inicio - 3)
+            contexto = lineas[inicio_contexto:fin + 1]
+            clave = hashlib.sha256(
+                (f"{inicio - inicio_contexto}\n" + '\n'.join(contexto)).encode('utf-8')
+            ).hexdigest()
+            
+            registros = self.cache_paginas.obtener('muestras', clave)
+            if registros is None:
+                registros = self._extraer_muestras_lineas(lineas, inicio, fin)
+                self.cache_paginas.guardar('muestras', clave, registros)
+            muestras.extend(dict(m) for m in registros)
+        return muestras
+    
     def _extraer_muestras_pdf(self, pdf_text):
         """
         Extrae información de muestras del texto del PDF.
@@ -236,19 +574,30 @@ class ComparadorMuestras:
         Returns:
             list: Lista de diccionarios con información de muestras
         """
-        muestras = []
-        
         # Patrones para identificar muestras en el formato de factura de TeleTest
         # Buscamos líneas que contengan códigos de muestra y análisis
         lineas = pdf_text.split('\n')
+        return self._extraer_muestras_lineas(lineas, 0, len(lineas))
+    
+    def _extraer_muestras_lineas(self, lineas, inicio, fin):
+        """
+        Extrae información de muestras de un rango de líneas del texto del PDF.
         
-        # Patrones para identificar códigos de muestra y análisis
-        patron_muestra = r'(\d{8})'  # Patrón para códigos de muestra (8 dígitos)
-        patron_codiEix = r'(M-\d{2}-\d{4})'  # Patrón para códigos Eix (M-XX-XXXX)
+        Args:
+            lineas (list): Todas las líneas del texto del PDF
+            inicio (int): Índice de la primera línea a analizar
+            fin (int): Índice posterior a la última línea a analizar
+        
+        Returns:
+            list: Lista de diccionarios con información de muestras
+        """
+        muestras = []
         
-        for i, linea in enumerate(lineas):
+        for i in range(inicio, fin):
+            linea = lineas[i]
+            
             # Buscar códigos de muestra
-            match_muestra = re.search(patron_muestra, linea)
+            match_muestra = re.search(self.PATRON_MUESTRA, linea)
             if match_muestra:
                 muestra = match_muestra.group(1)
                 
@@ -257,13 +606,13 @@ class ComparadorMuestras:
                 analisis = ""
                 
                 # Buscar en la línea actual
-                match_codiEix = re.search(patron_codiEix, linea)
+                match_codiEix = re.search(self.PATRON_CODI_EIX, linea)
                 if match_codiEix:
                     codiEix = match_codiEix.group(1)
                 
                 # Si no se encontró en la línea actual, buscar en las siguientes
                 if not codiEix and i+1 < len(lineas):
-                    match_codiEix = re.search(patron_codiEix, lineas[i+1])
+                    match_codiEix = re.search(self.PATRON_CODI_EIX, lineas[i+1])
                     if match_codiEix:
                         codiEix = match_codiEix.group(1)
                 
@@ -327,10 +676,20 @@ class ComparadorMuestras:
         # Eliminar espacios, puntos, guiones, etc.
         return re.sub(r'[^a-zA-Z0-9]', '', codigo)
     
-    def comparar_muestras(self):
+    def comparar_muestras(self, n_procesos=None):
         """
         Compara las muestras entre el Excel y el PDF.
         
+        Los registros de ambos lados se reparten por hash de 'muestra_norm' en
+        particiones independientes, que se comparan en paralelo en un pool de
+        procesos cuando el volumen lo justifica. Los resultados se combinan en el
+        mismo orden que la comparación secuencial.
+        
+        Args:
+            n_procesos (int): Número de procesos (por defecto, todos los núcleos
+                si hay más de UMBRAL_COMPARACION_PARALELA líneas; 1 = secuencial).
+                Si el pool de procesos falla, se compara en secuencial.
+        
         Returns:
             bool: True si la comparación fue exitosa, False en caso contrario
         """
@@ -339,64 +698,54 @@ class ComparadorMuestras:
                 st.error("No hay datos para comparar. Asegúrese de procesar primero los archivos.")
                 return False
             
-            # Crear diccionarios para facilitar la búsqueda
-            excel_dict = {m['muestra_norm']: m for m in self.excel_data}
+            if n_procesos is None:
+                total = len(self.excel_data) + len(self.pdf_data)
+                n_procesos = (os.cpu_count() or 1) if total >= UMBRAL_COMPARACION_PARALELA else 1
             
-            # Identificar muestras duplicadas en la factura
-            pdf_muestras = [m['muestra_norm'] for m in self.pdf_data]
-            duplicados = {m for m in pdf_muestras if pdf_muestras.count(m) > 1}
+            # Repartir ambos lados por hash de la muestra normalizada (con su posición original)
+            n_particiones = n_procesos * PARTICIONES_POR_PROCESO if n_procesos > 1 else 1
+            particiones_excel = [[] for _ in range(n_particiones)]
+            particiones_pdf = [[] for _ in range(n_particiones)]
+            for destino, datos in ((particiones_excel, self.excel_data), (particiones_pdf, self.pdf_data)):
+                for idx, m in enumerate(datos):
+                    particion = comparacion.particion_muestra(m['muestra_norm'], n_particiones)
+                    destino[particion].append((idx, m['muestra_norm'], m['codiEix'], m['analisis']))
             
-            # Procesar cada muestra del PDF
-            pdf_procesadas = set()
+            salidas = None
+            if n_procesos > 1:
+                pool = comparacion.obtener_pool(n_procesos)
+                try:
+                    salidas = list(pool.map(comparacion.comparar_particion, particiones_excel, particiones_pdf))
+                except (PicklingError, BrokenProcessPool, OSError, RuntimeError) as e:
+                    # RuntimeError: el pool se cerró mientras otra sesión cambiaba su tamaño
+                    logging.warning(f"Comparación en paralelo no disponible, se compara en secuencial: {str(e)}")
+                    comparacion.descartar_pool(pool)
+            if salidas is None:
+                salidas = list(map(comparacion.comparar_particion, particiones_excel, particiones_pdf))
             
-            for pdf_muestra in self.pdf_data:
-                muestra_norm = pdf_muestra['muestra_norm']
-                
-                # Verificar si es un duplicado
-                if muestra_norm in duplicados and muestra_norm in pdf_procesadas:
-                    self.resultados_comparacion['duplicados_factura'].append(pdf_muestra)
-                    continue
-                
-                pdf_procesadas.add(muestra_norm)
-                
-                # Verificar si la muestra está en el Excel
-                if muestra_norm in excel_dict:
-                    excel_muestra = excel_dict[muestra_norm]
-                    
-                    # Verificar si hay coincidencia completa o parcial
-                    coincidencia_completa = True
-                    
-                    # Verificar código Eix
-                    if excel_muestra['codiEix'] != pdf_muestra['codiEix']:
-                        coincidencia_completa = False
-                    
-                    # Verificar análisis (coincidencia parcial)
-                    analisis_coincide = self._comparar_analisis(
-                        excel_muestra['analisis'], 
-                        pdf_muestra['analisis']
-                    )
-                    
-                    if not analisis_coincide:
-                        coincidencia_completa = False
-                    
-                    if coincidencia_completa:
-                        self.resultados_comparacion['coincidencias'].append({
-                            'excel': excel_muestra,
-                            'pdf': pdf_muestra
-                        })
-                    else:
-                        self.resultados_comparacion['coincidencias_parciales'].append({
-                            'excel': excel_muestra,
-                            'pdf': pdf_muestra
-                        })
-                else:
-                    self.resultados_comparacion['factura_no_excel'].append(pdf_muestra)
+            # Combinar en el orden original de la factura y del Excel
+            categoria_pdf = [None] * len(self.pdf_data)
+            excel_pdf = [None] * len(self.pdf_data)
+            excel_no_factura = [False] * len(self.excel_data)
+            for clasificadas, no_facturadas in salidas:
+                for categoria, pdf_idx, excel_idx in clasificadas:
+                    categoria_pdf[pdf_idx] = categoria
+                    excel_pdf[pdf_idx] = excel_idx
+                for excel_idx in no_facturadas:
+                    excel_no_factura[excel_idx] = True
             
-            # Identificar muestras del Excel que no están en la factura
-            pdf_muestras_set = {m['muestra_norm'] for m in self.pdf_data}
+            for pdf_idx, pdf_muestra in enumerate(self.pdf_data):
+                categoria = categoria_pdf[pdf_idx]
+                if categoria in ('coincidencias', 'coincidencias_parciales'):
+                    self.resultados_comparacion[categoria].append({
+                        'excel': self.excel_data[excel_pdf[pdf_idx]],
+                        'pdf': pdf_muestra
+                    })
+                else:
+                    self.resultados_comparacion[categoria].append(pdf_muestra)
             
-            for excel_muestra in self.excel_data:
-                if excel_muestra['muestra_norm'] not in pdf_muestras_set:
+            for excel_idx, excel_muestra in enumerate(self.excel_data):
+                if excel_no_factura[excel_idx]:
                     self.resultados_comparacion['excel_no_factura'].append(excel_muestra)
             
             return True
@@ -416,22 +765,7 @@ class ComparadorMuestras:
         Returns:
             bool: True si los análisis son equivalentes, False en caso contrario
         """
-        if not analisis_excel or not analisis_pdf:
-            return False
-        
-        # Normalizar textos
-        analisis_excel = analisis_excel.lower()
-        analisis_pdf = analisis_pdf.lower()
-        
-        # Verificar si uno contiene al otro
-        if analisis_excel in analisis_pdf or analisis_pdf in analisis_excel:
-            return True
-        
-        # Calcular similitud
-        similarity = difflib.SequenceMatcher(None, analisis_excel, analisis_pdf).ratio()
-        
-        # Si la similitud es alta, considerar equivalentes
-        return similarity > 0.7
+        return comparacion.comparar_analisis(analisis_excel, analisis_pdf)
     
     def obtener_estadisticas(self):
         """
@@ -471,6 +805,927 @@ class ComparadorMuestras:
             'color_estado': color_estado
         }
 
+# Comparación por particiones
+# La comparación secuencial cuesta ~25 µs por línea; el pool ya arrancado añade
+# ~3-10 µs por línea de envío de datos y el primer uso paga ~1,5 s por proceso
+# al arrancarlo. Por debajo de ~100.000 líneas (~2,5 s) no compensa.
+UMBRAL_COMPARACION_PARALELA = 100000
+PARTICIONES_POR_PROCESO = 4
+
+# Diferencias entre ejecuciones (revisiones de factura)
+ETIQUETAS_CATEGORIAS = {
+    'coincidencias': 'Coincidencias exactas',
+    'coincidencias_parciales': 'Coincidencias parciales',
+    'excel_no_factura': 'Muestras del Excel no encontradas en factura',
+    'factura_no_excel': 'Muestras de la factura no encontradas en Excel',
+    'duplicados_factura': 'Muestras duplicadas en la factura'
+}
+
+def serializar_resultados(excel_nombre, pdf_nombre, estadisticas, resultados):
+    """
+    Construye el documento JSON que almacena una ejecución de la comparación.
+
+    Args:
+        excel_nombre (str): Nombre del archivo Excel
+        pdf_nombre (str): Nombre del archivo PDF
+        estadisticas (dict): Estadísticas de obtener_estadisticas
+        resultados (dict): resultados_comparacion del comparador
+
+    Returns:
+        dict: Documento serializable a JSON
+    """
+    return {
+        'excel': excel_nombre,
+        'pdf': pdf_nombre,
+        'fecha': datetime.now().isoformat(timespec='seconds'),
+        'estadisticas': estadisticas,
+        'resultados': resultados
+    }
+
+def cargar_resultados(archivo):
+    """
+    Lee los resultados de comparación de un documento JSON generado por
+    serializar_resultados.
+
+    Args:
+        archivo: Archivo JSON (ruta o archivo abierto)
+
+    Returns:
+        dict: Resultados por categoría
+
+    Raises:
+        ValueError: Si el archivo no es JSON o no tiene la estructura esperada
+    """
+    documento = json.load(archivo)
+    if not isinstance(documento, dict) or not isinstance(documento.get('resultados'), dict):
+        raise ValueError("falta el diccionario 'resultados'")
+    return documento['resultados']
+
+def _registro_resultado(item):
+    """
+    Devuelve el registro de muestra de un elemento de resultados. En las
+    coincidencias se usa el registro de la factura, que es el que cambia
+    entre revisiones.
+
+    Args:
+        item (dict): Elemento de una categoría de resultados
+
+    Returns:
+        dict: Registro de muestra
+    """
+    return item['pdf'] if 'pdf' in item else item
+
+def _clave_resultado(item):
+    """
+    Clave de emparejamiento (muestra_norm, codiEix) de un elemento de resultados.
+
+    Args:
+        item (dict): Elemento de una categoría de resultados
+
+    Returns:
+        tuple: Clave de emparejamiento
+    """
+    registro = _registro_resultado(item)
+    return (str(registro.get('muestra_norm', '')), str(registro.get('codiEix', '')))
+
+def diferenciar_resultados(anteriores, actuales):
+    """
+    Calcula las altas y bajas por categoría entre dos ejecuciones mediante un
+    hash join sobre (muestra_norm, codiEix), en tiempo lineal. Las claves
+    repetidas se tratan como multiconjunto, de modo que un duplicado nuevo
+    aparece como alta aunque la muestra ya estuviera en la ejecución anterior.
+
+    Args:
+        anteriores (dict): resultados_comparacion de la ejecución anterior
+        actuales (dict): resultados_comparacion de la ejecución nueva
+
+    Returns:
+        dict: Por categoría, diccionario con las listas 'añadidas' y 'eliminadas'
+    """
+    diferencias = {}
+    for categoria in ETIQUETAS_CATEGORIAS:
+        items_anteriores = anteriores.get(categoria, [])
+        items_actuales = actuales.get(categoria, [])
+
+        restantes = Counter(_clave_resultado(item) for item in items_anteriores)
+        añadidas = []
+        for item in items_actuales:
+            clave = _clave_resultado(item)
+            if restantes[clave] > 0:
+                restantes[clave] -= 1
+            else:
+                añadidas.append(item)
+
+        eliminadas = []
+        for item in items_anteriores:
+            clave = _clave_resultado(item)
+            if restantes[clave] > 0:
+                restantes[clave] -= 1
+                eliminadas.append(item)
+
+        diferencias[categoria] = {'añadidas': añadidas, 'eliminadas': eliminadas}
+    return diferencias
+
+# Historial de comparaciones
+RUTA_HISTORIAL = os.environ.get('COMPARADOR_HISTORIAL', 'historial_comparaciones.db')
+
+class HistorialComparaciones:
+    """Almacén SQLite con el historial de comparaciones y consultas agregadas."""
+    
+    # Agrupaciones permitidas en las consultas agregadas
+    AGRUPACIONES = ('mes', 'instalacion', 'codiEix', 'factura')
+    
+    ESQUEMA = """
+        CREATE TABLE IF NOT EXISTS ejecuciones (
+            id INTEGER PRIMARY KEY,
+            factura TEXT NOT NULL,
+            excel TEXT,
+            pdf TEXT,
+            fecha TEXT NOT NULL,
+            mes TEXT NOT NULL,
+            total_excel INTEGER,
+            total_pdf INTEGER,
+            total_coincidencias INTEGER,
+            total_parciales INTEGER,
+            total_excel_no_factura INTEGER,
+            total_factura_no_excel INTEGER,
+            total_duplicados INTEGER,
+            estado TEXT,
+            hash TEXT,
+            numero_factura TEXT,
+            vigente INTEGER NOT NULL DEFAULT 1
+        );
+        CREATE TABLE IF NOT EXISTS lineas (
+            ejecucion_id INTEGER NOT NULL REFERENCES ejecuciones(id),
+            factura TEXT NOT NULL,
+            fecha TEXT NOT NULL,
+            categoria TEXT NOT NULL,
+            muestra TEXT,
+            muestra_norm TEXT,
+            codiEix TEXT,
+            instalacion TEXT,
+            analisis TEXT
+        );
+        CREATE TABLE IF NOT EXISTS agregados (
+            ejecucion_id INTEGER NOT NULL REFERENCES ejecuciones(id),
+            factura TEXT NOT NULL,
+            fecha TEXT NOT NULL,
+            mes TEXT NOT NULL,
+            instalacion TEXT NOT NULL,
+            codiEix TEXT NOT NULL,
+            lineas INTEGER NOT NULL,
+            discrepancias INTEGER NOT NULL,
+            vigente INTEGER NOT NULL DEFAULT 1
+        );
+    """
+    
+    INDICES = """
+        CREATE INDEX IF NOT EXISTS idx_ejecuciones_factura ON ejecuciones(factura);
+        CREATE INDEX IF NOT EXISTS idx_ejecuciones_hash ON ejecuciones(hash);
+        CREATE INDEX IF NOT EXISTS idx_ejecuciones_numero_factura ON ejecuciones(numero_factura, vigente);
+        CREATE INDEX IF NOT EXISTS idx_ejecuciones_fecha ON ejecuciones(fecha);
+        CREATE INDEX IF NOT EXISTS idx_lineas_ejecucion ON lineas(ejecucion_id);
+        CREATE INDEX IF NOT EXISTS idx_lineas_factura ON lineas(factura);
+        CREATE INDEX IF NOT EXISTS idx_lineas_muestra ON lineas(muestra_norm, codiEix);
+        DROP INDEX IF EXISTS idx_agregados_vigente_factura;
+        CREATE INDEX IF NOT EXISTS idx_agregados_ejecucion ON agregados(ejecucion_id);
+        CREATE INDEX IF NOT EXISTS idx_agregados_fecha ON agregados(vigente, fecha);
+        CREATE INDEX IF NOT EXISTS idx_agregados_mes ON agregados(vigente, mes, lineas, discrepancias);
+        CREATE INDEX IF NOT EXISTS idx_agregados_instalacion ON agregados(vigente, instalacion, lineas, discrepancias);
+        CREATE INDEX IF NOT EXISTS idx_agregados_codiEix ON agregados(vigente, codiEix, lineas, discrepancias);
+        CREATE INDEX IF NOT EXISTS idx_agregados_factura ON agregados(vigente, factura, lineas, discrepancias);
+    """
+    
+    def __init__(self, ruta=RUTA_HISTORIAL):
+        """
+        Inicializa el historial y crea el esquema si no existe.
+        
+        Args:
+            ruta (str): Ruta del archivo SQLite
+        """
+        self.ruta = str(ruta)
+        with self._conectar() as con:
+            # WAL permite consultar el historial mientras el daemon escribe
+            con.execute("PRAGMA journal_mode=WAL")
+            con.executescript(self.ESQUEMA)
+            self._migrar(con)
+            con.executescript(self.INDICES)
+    
+    def _migrar(self, con):
+        """
+        Añade a historiales creados con versiones anteriores las columnas de hash,
+        número de factura y ejecución vigente.
+        
+        Args:
+            con (sqlite3.Connection): Conexión abierta
+        """
+        columnas = {fila['name'] for fila in con.execute("PRAGMA table_info(ejecuciones)")}
+        if 'numero_factura' in columnas:
+            return
+        with con:
+            if 'vigente' not in columnas:
+                con.execute("ALTER TABLE ejecuciones ADD COLUMN hash TEXT")
+                con.execute("ALTER TABLE ejecuciones ADD COLUMN vigente INTEGER NOT NULL DEFAULT 1")
+                con.execute("ALTER TABLE agregados ADD COLUMN vigente INTEGER NOT NULL DEFAULT 1")
+            con.execute("ALTER TABLE ejecuciones ADD COLUMN numero_factura TEXT")
+            # Sin número de factura explícito no hay forma de saber qué ejecución sustituye
+            # a cuál: todas las que sigan guardadas vuelven a contar
+            con.execute("UPDATE ejecuciones SET vigente = 1")
+            con.execute("UPDATE agregados SET vigente = 1")
+    
+    def _conectar(self):
+        """
+        Abre una conexión nueva (una por operación, para poder usarse desde varios hilos).
+        
+        Returns:
+            contextlib.closing: Conexión que se cierra al salir del bloque with
+        """
+        con = sqlite3.connect(self.ruta, timeout=30)
+        con.row_factory = sqlite3.Row
+        return closing(con)
+    
+    def registrar(self, excel_nombre, pdf_nombre, estadisticas, resultados, factura=None, fecha=None,
+                  hash_contenido=None):
+        """
+        Guarda una comparación completada. Repetir una comparación con el mismo
+        contenido la reemplaza. Si se indica el número de factura, las ejecuciones
+        anteriores con ese número (facturas reemitidas) dejan de contar en las
+        consultas agregadas, aunque se conservan como historial. El nombre del
+        archivo nunca se usa para sustituir ejecuciones: dos facturas distintas
+        pueden llamarse igual.
+        
+        Args:
+            excel_nombre (str): Nombre del archivo Excel
+            pdf_nombre (str): Nombre del archivo PDF
+            estadisticas (dict): Estadísticas de obtener_estadisticas
+            resultados (dict): resultados_comparacion del comparador
+            factura (str): Número de factura; las ejecuciones anteriores con el mismo
+                número quedan sustituidas (por defecto, se usa el nombre del PDF solo como etiqueta)
+            fecha (str): Fecha ISO de la ejecución (por defecto, ahora)
+            hash_contenido (str): Hash del par Excel/PDF; si ya existe una ejecución
+                con el mismo contenido, se reemplaza
+        
+        Returns:
+            int: Identificador de la ejecución guardada
+        """
+        numero_factura = factura or None
+        factura = factura or Path(pdf_nombre).stem
+        fecha = fecha or datetime.now().isoformat(timespec='seconds')
+        mes = fecha[:7]
+        
+        filas_lineas = []
+        agregados = Counter()
+        for categoria in ETIQUETAS_CATEGORIAS:
+            discrepancia = int(categoria != 'coincidencias')
+            for item in resultados.get(categoria, []):
+                registro = _registro_resultado(item)
+                muestra_norm, codiEix = _clave_resultado(item)
+                # La instalación suele venir del Excel; en la factura puede no extraerse
+                instalacion = str((item['excel'] if 'excel' in item else registro).get('instalacion', '') or
+                                  registro.get('instalacion', ''))
+                filas_lineas.append((factura, fecha, categoria, str(registro.get('muestra', '')), muestra_norm,
+                                     codiEix, instalacion, str(registro.get('analisis', ''))))
+                agregados[(instalacion, codiEix, discrepancia)] += 1
+        
+        with self._conectar() as con, con:
+            # El mismo contenido ya registrado se reemplaza en lugar de duplicarse
+            if hash_contenido:
+                anteriores = [fila['id'] for fila in
+                              con.execute("SELECT id FROM ejecuciones WHERE hash = ?", (hash_contenido,))]
+                for tabla, columna in (('lineas', 'ejecucion_id'), ('agregados', 'ejecucion_id'), ('ejecuciones', 'id')):
+                    con.executemany(f"DELETE FROM {tabla} WHERE {columna} = ?", [(i,) for i in anteriores])
+            
+            # Las ejecuciones previas del mismo número de factura dejan de contar en los agregados
+            if numero_factura:
+                sustituidas = [(fila['id'],) for fila in con.execute(
+                    "SELECT id FROM ejecuciones WHERE numero_factura = ? AND vigente = 1", (numero_factura,))]
+                con.executemany("UPDATE agregados SET vigente = 0 WHERE ejecucion_id = ?", sustituidas)
+                con.executemany("UPDATE ejecuciones SET vigente = 0 WHERE id = ?", sustituidas)
+            
+            cursor = con.execute(
+                """INSERT INTO ejecuciones (factura, excel, pdf, fecha, mes, total_excel, total_pdf,
+                       total_coincidencias, total_parciales, total_excel_no_factura,
+                       total_factura_no_excel, total_duplicados, estado, hash, numero_factura, vigente)
+                   VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 1)""",
+                (factura, excel_nombre, pdf_nombre, fecha, mes,
+                 estadisticas['total_excel'], estadisticas['total_pdf'],
+                 estadisticas['total_coincidencias'], estadisticas['total_parciales'],
+                 estadisticas['total_excel_no_factura'], estadisticas['total_factura_no_excel'],
+                 estadisticas['total_duplicados'], estadisticas['estado'], hash_contenido, numero_factura)
+            )
+            ejecucion_id = cursor.lastrowid
+            con.executemany(
+                """INSERT INTO lineas (ejecucion_id, factura, fecha, categoria, muestra, muestra_norm,
+                       codiEix, instalacion, analisis)
+                   VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                [(ejecucion_id,) + fila for fila in filas_lineas]
+            )
+            
+            # Agregado por ejecución, instalación y código Eix para las consultas de tendencias
+            por_grupo = {}
+            for (instalacion, codiEix, discrepancia), cantidad in agregados.items():
+                lineas, discrepancias = por_grupo.get((instalacion, codiEix), (0, 0))
+                por_grupo[(instalacion, codiEix)] = (lineas + cantidad, discrepancias + cantidad * discrepancia)
+            con.executemany(
+                """INSERT INTO agregados (ejecucion_id, factura, fecha, mes, instalacion, codiEix,
+                       lineas, discrepancias)
+                   VALUES (?, ?, ?, ?, ?, ?, ?, ?)""",
+                [(ejecucion_id, factura, fecha, mes, instalacion, codiEix, lineas, discrepancias)
+                 for (instalacion, codiEix), (lineas, discrepancias) in por_grupo.items()]
+            )
+        return ejecucion_id
+    
+    def tasa_discrepancias(self, agrupar_por='mes', desde=None, hasta=None):
+        """
+        Calcula la tasa de discrepancias agrupada, sin volver a leer ningún archivo.
+        No cuenta las ejecuciones sustituidas por una reemisión de la misma factura.
+        
+        Args:
+            agrupar_por (str): Una de AGRUPACIONES ('mes', 'instalacion', 'codiEix', 'factura')
+            desde (str): Fecha mínima (YYYY-MM-DD), incluida
+            hasta (str): Fecha máxima (YYYY-MM-DD), incluida
+        
+        Returns:
+            list: Lista de diccionarios con 'grupo', 'lineas', 'discrepancias' y 'tasa'
+        """
+        if agrupar_por not in self.AGRUPACIONES:
+            raise ValueError(f"Agrupación no válida: {agrupar_por}")
+        
+        condiciones = ["vigente = 1"]
+        parametros = []
+        if desde:
+            condiciones.append("fecha >= ?")
+            parametros.append(str(desde))
+        if hasta:
+            condiciones.append("fecha < date(?, '+1 day')")
+            parametros.append(str(hasta))
+        where = f"WHERE {' AND '.join(condiciones)}"
+        
+        with self._conectar() as con:
+            filas = con.execute(
+                f"""SELECT {agrupar_por} AS grupo, SUM(lineas) AS lineas, SUM(discrepancias) AS discrepancias
+                    FROM agregados {where}
+                    GROUP BY {agrupar_por}
+                    ORDER BY {agrupar_por}""",
+                parametros
+            ).fetchall()
+        
+        return [{
+            'grupo': fila['grupo'],
+            'lineas': fila['lineas'],
+            'discrepancias': fila['discrepancias'],
+            'tasa': fila['discrepancias'] / fila['lineas'] if fila['lineas'] else 0.0
+        } for fila in filas]
+    
+    def ejecuciones(self, factura=None, limite=100):
+        """
+        Lista las ejecuciones guardadas, de la más reciente a la más antigua.
+        
+        Args:
+            factura (str): Filtrar por identificador de factura
+            limite (int): Número máximo de ejecuciones devueltas
+        
+        Returns:
+            list: Lista de diccionarios con los datos de cada ejecución
+        """
+        with self._conectar() as con:
+            if factura:
+                filas = con.execute("SELECT * FROM ejecuciones WHERE factura = ? ORDER BY fecha DESC LIMIT ?",
+                                    (factura, limite)).fetchall()
+            else:
+                filas = con.execute("SELECT * FROM ejecuciones ORDER BY fecha DESC LIMIT ?",
+                                    (limite,)).fetchall()
+        return [dict(fila) for fila in filas]
+    
+    def lineas_ejecucion(self, ejecucion_id):
+        """
+        Devuelve las líneas de resultados de una ejecución.
+        
+        Args:
+            ejecucion_id (int): Identificador de la ejecución
+        
+        Returns:
+            list: Lista de diccionarios con categoría y datos de la muestra
+        """
+        with self._conectar() as con:
+            filas = con.execute(
+                """SELECT categoria, muestra, muestra_norm, codiEix, instalacion, analisis
+                   FROM lineas WHERE ejecucion_id = ? ORDER BY rowid""",
+                (ejecucion_id,)
+            ).fetchall()
+        return [dict(fila) for fila in filas]
+
+# Modo vigilancia de carpeta (daemon de ingesta)
+EXTENSIONES_EXCEL = ('.xlsx', '.xls')
+EXTENSIONES_PDF = ('.pdf',)
+REGISTRO_PROCESADOS = 'procesados.json'
+FICHERO_METRICAS = 'metricas.jsonl'
+DIRECTORIO_CACHE = 'cache_paginas'
+# Reintentos de un par que tumba el proceso cuando se ejecuta en solitario
+MAX_REINTENTOS = 3
+# Espera máxima (segundos) antes de reintentar un par tras un fallo de infraestructura
+ESPERA_MAXIMA_REINTENTO = 300
+# Cada cuánto (segundos) se eliminan de la caché de páginas las entradas sin usar
+INTERVALO_LIMPIEZA_CACHE = 24 * 3600
+
+def _hash_archivo(ruta, tam_bloque=1024 * 1024):
+    """
+    Calcula el hash SHA-256 del contenido de un archivo leyéndolo por bloques.
+
+    Args:
+        ruta (Path): Ruta del archivo
+        tam_bloque (int): Tamaño de bloque de lectura en bytes
+
+    Returns:
+        str: Hash hexadecimal del contenido
+    """
+    h = hashlib.sha256()
+    with open(ruta, 'rb') as f:
+        for bloque in iter(lambda: f.read(tam_bloque), b''):
+            h.update(bloque)
+    return h.hexdigest()
+
+def _hash_par(hash_excel, hash_pdf):
+    """
+    Hash que identifica el contenido de un par Excel/PDF.
+
+    Args:
+        hash_excel (str): Hash SHA-256 del Excel
+        hash_pdf (str): Hash SHA-256 del PDF
+
+    Returns:
+        str: Hash hexadecimal del par
+    """
+    return hashlib.sha256((hash_excel + hash_pdf).encode('ascii')).hexdigest()
+
+def _escribir_json_atomico(ruta, datos):
+    """
+    Escribe un JSON en disco de forma atómica (archivo temporal + reemplazo).
+
+    Args:
+        ruta (Path): Ruta de destino
+        datos: Objeto serializable a JSON
+    """
+    ruta = Path(ruta)
+    fd, ruta_tmp = tempfile.mkstemp(dir=ruta.parent, prefix='.' + ruta.name, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(datos, f, ensure_ascii=False, indent=2, default=str)
+        os.replace(ruta_tmp, ruta)
+    except BaseException:
+        # No dejar temporales a medias (disco lleno, permisos...)
+        try:
+            os.unlink(ruta_tmp)
+        except OSError:
+            pass
+        raise
+
+def _emparejar_archivos(entradas):
+    """
+    Empareja cada PDF de factura con el Excel de muestras del mismo nombre base.
+
+    Args:
+        entradas (list): Lista de rutas (Path) presentes en la carpeta de entrada
+
+    Returns:
+        list: Lista de tuplas (ruta_excel, ruta_pdf) ordenada por nombre
+    """
+    excels = {}
+    pdfs = {}
+    for ruta in entradas:
+        sufijo = ruta.suffix.lower()
+        if sufijo in EXTENSIONES_EXCEL:
+            excels[ruta.stem.lower()] = ruta
+        elif sufijo in EXTENSIONES_PDF:
+            pdfs[ruta.stem.lower()] = ruta
+
+    return [(excels[nombre], pdfs[nombre]) for nombre in sorted(pdfs) if nombre in excels]
+
+def _procesar_par(ruta_excel, ruta_pdf, dir_cache=None):
+    """
+    Ejecuta la comparación completa de un par Excel/PDF. Se ejecuta en un
+    proceso del pool del daemon.
+
+    Args:
+        ruta_excel (str): Ruta del archivo Excel
+        ruta_pdf (str): Ruta del archivo PDF
+        dir_cache (str): Carpeta de la caché de páginas compartida entre procesos
+
+    Returns:
+        dict: Resultado con estadísticas, resultados de comparación y tiempos por etapa
+    """
+    tiempos = {}
+    cache = CachePaginasPDF(dir_cache) if dir_cache else None
+    comparador = ComparadorMuestras(ruta_excel, ruta_pdf, cache_paginas=cache)
+
+    # Descartar rápidamente archivos que no son un Excel de muestras o una factura de TeleTest
+    veredicto = comparador.validar_preflight()
+    tiempos['preflight'] = veredicto['tiempo']
+    if not veredicto['valido']:
+        return {'ok': False, 'error': "; ".join(veredicto['errores']), 'tiempos': tiempos}
+
+    etapas = [
+        ('excel', comparador.procesar_excel, "Error al procesar el archivo Excel"),
+        ('pdf', comparador.procesar_pdf, "Error al procesar el archivo PDF"),
+        # Cada par ya ocupa un proceso del pool: comparación secuencial
+        ('comparacion', lambda: comparador.comparar_muestras(n_procesos=1), "Error al comparar las muestras"),
+    ]
+    for nombre, etapa, mensaje_error in etapas:
+        inicio = time.perf_counter()
+        ok = etapa()
+        tiempos[nombre] = round(time.perf_counter() - inicio, 4)
+        if not ok:
+            return {'ok': False, 'error': mensaje_error, 'tiempos': tiempos}
+
+    return {
+        'ok': True,
+        'error': None,
+        'tiempos': tiempos,
+        'estadisticas': comparador.obtener_estadisticas(),
+        'resultados': comparador.resultados_comparacion
+    }
+
+class DaemonIngesta:
+    """Vigila una carpeta de entrada y compara los pares Excel/PDF que llegan."""
+
+    def __init__(self, entrada, salida, max_procesos=None, intervalo=5.0, historial=None, dias_cache=30):
+        """
+        Inicializa el daemon.
+
+        Args:
+            entrada (str): Carpeta vigilada donde se depositan Excel y PDF
+            salida (str): Carpeta donde se escriben resultados y métricas
+            max_procesos (int): Número máximo de procesos del pool (por defecto, núcleos disponibles)
+            intervalo (float): Segundos entre exploraciones de la carpeta
+            historial (str): Ruta del historial SQLite (por defecto, dentro de la carpeta de salida)
+            dias_cache (float): Días sin uso tras los que se eliminan entradas de la caché de páginas (0 = nunca)
+        """
+        self.entrada = Path(entrada)
+        self.salida = Path(salida)
+        self.salida.mkdir(parents=True, exist_ok=True)
+        self.historial = HistorialComparaciones(historial or self.salida / RUTA_HISTORIAL)
+        self.max_procesos = max_procesos or os.cpu_count() or 1
+        # Limitar los trabajos en vuelo para no saturar el equipo en ráfagas
+        self.max_en_vuelo = self.max_procesos * 2
+        self.intervalo = intervalo
+        self.cache_paginas = CachePaginasPDF(self.salida / DIRECTORIO_CACHE)
+        self.dias_cache = dias_cache
+        self._ultima_limpieza = None
+
+        self.registro_ruta = self.salida / REGISTRO_PROCESADOS
+        self.procesados = self._cargar_registro()
+
+        # Firma (tamaño, mtime) de cada archivo y el instante en que se vio por primera vez,
+        # para detectar archivos aún en copia
+        self._firmas_previas = {}
+        # Hashes ya calculados por ruta y firma, para no releer archivos sin cambios
+        self._cache_hashes = {}
+        # Trabajos en curso: future -> (hash_par, ruta_excel, ruta_pdf, instante_envio)
+        self._pendientes = {}
+        # Pares que estaban en vuelo cuando se rompió el pool: se reejecutan de uno en uno
+        # para encontrar el que lo tumbó sin penalizar a los demás
+        self._sospechosos = set()
+        # Future del par sospechoso que se está ejecutando en solitario
+        self._aislado = None
+        # Caídas del proceso por par ejecutado en solitario, para no reintentar indefinidamente un archivo que tumba el proceso
+        self._reintentos = Counter()
+        # Fallos de infraestructura por par: hash_par -> (número de fallos, instante a partir del cual reintentar)
+        self._esperas = {}
+
+    def _cargar_registro(self):
+        """
+        Carga el registro de pares ya procesados.
+
+        Returns:
+            dict: Diccionario hash_par -> información del procesamiento
+        """
+        if self.registro_ruta.exists():
+            try:
+                with open(self.registro_ruta, encoding='utf-8') as f:
+                    return json.load(f)
+            except (OSError, ValueError) as e:
+                logging.warning(f"No se pudo leer el registro de procesados: {str(e)}")
+        return {}
+
+    def _archivos_estables(self):
+        """
+        Lista los archivos de la carpeta de entrada cuyo tamaño y fecha de
+        modificación no han cambiado durante al menos el intervalo de exploración.
+        Las exploraciones pueden sucederse en milisegundos al terminar trabajos,
+        así que no basta con que coincidan dos exploraciones seguidas.
+
+        Returns:
+            list: Rutas (Path) de archivos listos para procesar
+        """
+        firmas = {}
+        estables = []
+        ahora = time.monotonic()
+        for ruta in self.entrada.iterdir():
+            if not ruta.is_file() or ruta.name.startswith('.'):
+                continue
+            try:
+                st_archivo = ruta.stat()
+            except OSError:
+                continue
+            firma = (st_archivo.st_size, st_archivo.st_mtime_ns)
+            previa = self._firmas_previas.get(ruta)
+            vista_desde = previa[1] if previa and previa[0] == firma else ahora
+            firmas[ruta] = (firma, vista_desde)
+            if ahora - vista_desde >= self.intervalo:
+                estables.append(ruta)
+        self._firmas_previas = firmas
+        self._cache_hashes = {r: v for r, v in self._cache_hashes.items() if r in firmas}
+        return estables
+
+    def _hash(self, ruta):
+        """
+        Devuelve el hash del contenido de un archivo, reutilizando el ya calculado
+        si el archivo no ha cambiado.
+
+        Args:
+            ruta (Path): Ruta del archivo
+
+        Returns:
+            str: Hash hexadecimal del contenido
+        """
+        firma = self._firmas_previas.get(ruta, (None, None))[0]
+        cacheado = self._cache_hashes.get(ruta)
+        if cacheado and cacheado[0] == firma:
+            return cacheado[1]
+        valor = _hash_archivo(ruta)
+        self._cache_hashes[ruta] = (firma, valor)
+        return valor
+
+    def _enviar_nuevos(self, pool):
+        """
+        Explora la carpeta de entrada y envía al pool los pares nuevos,
+        sin superar el límite de trabajos en vuelo.
+
+        Args:
+            pool (ProcessPoolExecutor): Pool de procesos
+        """
+        en_vuelo = {hash_par for hash_par, _, _, _ in self._pendientes.values()}
+        if self._sospechosos and self._pendientes:
+            # Los sospechosos se ejecutan solos: esperar a que se vacíe el pool
+            return
+
+        ahora = time.monotonic()
+        vistos = set()
+        for ruta_excel, ruta_pdf in _emparejar_archivos(self._archivos_estables()):
+            if len(self._pendientes) >= self.max_en_vuelo:
+                # El resto se recogerá en la siguiente exploración
+                break
+            try:
+                hash_par = _hash_par(self._hash(ruta_excel), self._hash(ruta_pdf))
+            except OSError as e:
+                logging.warning(f"No se pudo leer {ruta_excel.name}/{ruta_pdf.name}: {str(e)}")
+                continue
+
+            if hash_par in self.procesados or hash_par in en_vuelo:
+                continue
+            vistos.add(hash_par)
+            if self._sospechosos and hash_par not in self._sospechosos:
+                continue
+            elif hash_par in self._esperas and ahora < self._esperas[hash_par][1]:
+                continue
+
+            future = pool.submit(_procesar_par, str(ruta_excel), str(ruta_pdf),
+                                 str(self.cache_paginas.directorio))
+            self._pendientes[future] = (hash_par, ruta_excel, ruta_pdf, time.perf_counter())
+            en_vuelo.add(hash_par)
+            if self._sospechosos:
+                self._sospechosos.discard(hash_par)
+                self._aislado = future
+                logging.info(f"Encolado en solitario: {ruta_excel.name} + {ruta_pdf.name}")
+                return
+            logging.info(f"Encolado: {ruta_excel.name} + {ruta_pdf.name}")
+
+        # Sospechosos cuyos archivos ya no están en la carpeta de entrada
+        self._sospechosos &= vistos
+
+    def _posponer(self, hash_par, ruta_pdf, motivo):
+        """
+        Deja un par sin registrar para reintentarlo más tarde, con una espera
+        que se duplica en cada fallo.
+
+        Args:
+            hash_par (str): Hash del par
+            ruta_pdf (Path): Ruta del PDF, para el log
+            motivo (str): Descripción del fallo
+        """
+        fallos = self._esperas.get(hash_par, (0, 0))[0] + 1
+        espera = min(self.intervalo * 2 ** fallos, ESPERA_MAXIMA_REINTENTO)
+        self._esperas[hash_par] = (fallos, time.monotonic() + espera)
+        logging.warning(f"Fallo de infraestructura con {ruta_pdf.name}, se reintentará en {espera:.0f} s: {motivo}")
+
+    def _recoger(self, futures):
+        """
+        Guarda los resultados y métricas de los trabajos terminados.
+
+        Args:
+            futures (iterable): Futures completados
+        """
+        for future in futures:
+            hash_par, ruta_excel, ruta_pdf, enviado = self._pendientes.pop(future)
+            en_solitario = future is self._aislado
+            if en_solitario:
+                self._aislado = None
+            try:
+                resultado = future.result()
+            except BrokenProcessPool as e:
+                if not en_solitario:
+                    # No se sabe qué par tumbó el proceso: se reejecutan de uno en uno
+                    logging.warning(f"El pool se rompió con {ruta_pdf.name} en vuelo; se reejecutará en solitario")
+                    self._sospechosos.add(hash_par)
+                    continue
+                # En solitario, el fallo es de este par
+                self._reintentos[hash_par] += 1
+                if self._reintentos[hash_par] <= MAX_REINTENTOS:
+                    logging.warning(f"{ruta_pdf.name} tumbó el proceso, se reintentará "
+                                    f"({self._reintentos[hash_par]}/{MAX_REINTENTOS}): {str(e) or type(e).__name__}")
+                    self._sospechosos.add(hash_par)
+                    continue
+                resultado = {'ok': False, 'tiempos': {},
+                             'error': f"El proceso cayó en {MAX_REINTENTOS + 1} intentos: {str(e) or type(e).__name__}"}
+            except (PicklingError, OSError) as e:
+                # Fallo de infraestructura, no del contenido: no se registra ni cuenta como intento
+                self._posponer(hash_par, ruta_pdf, str(e) or type(e).__name__)
+                continue
+            except Exception as e:
+                resultado = {'ok': False, 'error': str(e), 'tiempos': {}}
+            self._reintentos.pop(hash_par, None)
+            self._esperas.pop(hash_par, None)
+
+            try:
+                registro = self._guardar_resultado(hash_par, ruta_excel, ruta_pdf, enviado, resultado)
+            except OSError as e:
+                # Disco lleno, permisos...: el par queda sin registrar y se reintenta
+                self._posponer(hash_par, ruta_pdf, f"no se pudo escribir la salida: {str(e)}")
+                continue
+            # Los fallos de validación o procesamiento también se registran para no reintentar el mismo contenido en bucle
+            self.procesados[hash_par] = registro
+        try:
+            _escribir_json_atomico(self.registro_ruta, self.procesados)
+        except OSError as e:
+            # Se conserva en memoria y se vuelve a escribir al recoger el siguiente trabajo
+            logging.error(f"No se pudo guardar el registro de procesados: {str(e)}")
+
+    def _guardar_resultado(self, hash_par, ruta_excel, ruta_pdf, enviado, resultado):
+        """
+        Escribe el JSON de resultados, la métrica y el historial de un trabajo terminado.
+
+        Args:
+            hash_par (str): Hash del par
+            ruta_excel (Path): Ruta del Excel
+            ruta_pdf (Path): Ruta del PDF
+            enviado (float): Instante de envío al pool (perf_counter)
+            resultado (dict): Resultado devuelto por _procesar_par
+
+        Returns:
+            dict: Entrada del registro de procesados
+
+        Raises:
+            OSError: Si no se puede escribir en la carpeta de salida
+        """
+        nombre_salida = None
+        if resultado['ok']:
+            nombre_salida = f"{ruta_pdf.stem}_{hash_par[:12]}.json"
+            documento = serializar_resultados(ruta_excel.name, ruta_pdf.name,
+                                              resultado['estadisticas'], resultado['resultados'])
+            documento['hash'] = hash_par
+            _escribir_json_atomico(self.salida / nombre_salida, documento)
+            try:
+                self.historial.registrar(ruta_excel.name, ruta_pdf.name,
+                                         resultado['estadisticas'], resultado['resultados'],
+                                         fecha=documento['fecha'], hash_contenido=hash_par)
+            except sqlite3.Error as e:
+                logging.error(f"No se pudo guardar {ruta_pdf.name} en el historial: {str(e)}")
+            logging.info(f"Procesado: {ruta_pdf.name} -> {resultado['estadisticas']['estado']}")
+        else:
+            logging.error(f"Fallo al procesar {ruta_pdf.name}: {resultado['error']}")
+
+        metrica = {
+            'fecha': datetime.now().isoformat(timespec='seconds'),
+            'hash': hash_par,
+            'excel': ruta_excel.name,
+            'pdf': ruta_pdf.name,
+            'ok': resultado['ok'],
+            'error': resultado['error'],
+            'tiempos': resultado['tiempos'],
+            'tiempo_total': round(time.perf_counter() - enviado, 4),
+            'resultado': nombre_salida
+        }
+        if resultado['ok']:
+            metrica.update({k: v for k, v in resultado['estadisticas'].items() if k.startswith('total_')})
+        with open(self.salida / FICHERO_METRICAS, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(metrica, ensure_ascii=False) + '\n')
+
+        return {
+            'excel': ruta_excel.name,
+            'pdf': ruta_pdf.name,
+            'fecha': metrica['fecha'],
+            'ok': resultado['ok'],
+            'resultado': nombre_salida
+        }
+
+    def _limpiar_cache(self):
+        """
+        Elimina de la caché de páginas en disco las entradas sin usar, como mucho
+        una vez cada INTERVALO_LIMPIEZA_CACHE segundos.
+        """
+        if not self.dias_cache:
+            return
+        ahora = time.monotonic()
+        if self._ultima_limpieza is not None and ahora - self._ultima_limpieza < INTERVALO_LIMPIEZA_CACHE:
+            return
+        self._ultima_limpieza = ahora
+        eliminados = self.cache_paginas.limpiar_disco(self.dias_cache)
+        if eliminados:
+            logging.info(f"Caché de páginas: {eliminados} entradas sin usar en {self.dias_cache:g} días eliminadas")
+
+    def ejecutar(self, una_vez=False):
+        """
+        Bucle principal del daemon.
+
+        Args:
+            una_vez (bool): Si es True, procesa el contenido actual de la carpeta y termina
+        """
+        logging.info(f"Vigilando {self.entrada} con {self.max_procesos} procesos")
+        pool = ProcessPoolExecutor(max_workers=self.max_procesos)
+        try:
+            # Primera exploración solo para registrar firmas de archivos
+            self._archivos_estables()
+            time.sleep(self.intervalo)
+            while True:
+                self._limpiar_cache()
+                try:
+                    self._enviar_nuevos(pool)
+                except BrokenProcessPool:
+                    # Un proceso murió (memoria, fallo del intérprete...): recrear el pool y seguir.
+                    # Los trabajos en vuelo terminan con BrokenProcessPool y se reejecutan de uno en uno.
+                    logging.error("El pool de procesos se ha roto; se crea uno nuevo")
+                    pool.shutdown(wait=False, cancel_futures=True)
+                    pool = ProcessPoolExecutor(max_workers=self.max_procesos)
+                    continue
+
+                if self._pendientes:
+                    terminados, _ = wait(list(self._pendientes), timeout=self.intervalo,
+                                         return_when=FIRST_COMPLETED)
+                    if terminados:
+                        self._recoger(terminados)
+                elif una_vez:
+                    break
+                else:
+                    time.sleep(self.intervalo)
+        finally:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+def _ejecutar_daemon(argumentos):
+    """
+    Punto de entrada del modo vigilancia desde la línea de comandos.
+
+    Args:
+        argumentos (list): Argumentos de la línea de comandos
+    """
+    parser = argparse.ArgumentParser(description="Comparador de Muestras - modo vigilancia de carpeta")
+    parser.add_argument('--vigilar', required=True, help="Carpeta de entrada con los Excel y PDF")
+    parser.add_argument('--salida', required=True, help="Carpeta donde escribir resultados y métricas")
+    parser.add_argument('--procesos', type=int, default=None, help="Número máximo de procesos en paralelo")
+    parser.add_argument('--intervalo', type=float, default=5.0, help="Segundos entre exploraciones")
+    parser.add_argument('--una-vez', action='store_true', help="Procesar el contenido actual y terminar")
+    parser.add_argument('--historial', default=None, help="Ruta del historial SQLite de comparaciones")
+    parser.add_argument('--cache-dias', type=float, default=30,
+                        help="Días sin uso tras los que se eliminan páginas de la caché (0 = no limpiar)")
+    args = parser.parse_args(argumentos)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+    daemon = DaemonIngesta(args.vigilar, args.salida, max_procesos=args.procesos, intervalo=args.intervalo,
+                           historial=args.historial, dias_cache=args.cache_dias)
+    try:
+        daemon.ejecutar(una_vez=args.una_vez)
+    except KeyboardInterrupt:
+        logging.info("Daemon detenido")
+
+@st.cache_resource
+def _obtener_cache_paginas():
+    """
+    Devuelve la caché de páginas compartida entre sesiones de Streamlit.
+
+    Returns:
+        CachePaginasPDF: Caché en memoria
+    """
+    return CachePaginasPDF()
+
+@st.cache_resource
+def _obtener_historial():
+    """
+    Devuelve el historial de comparaciones compartido entre sesiones de Streamlit.
+
+    Returns:
+        HistorialComparaciones: Historial SQLite
+    """
+    return HistorialComparaciones()
+
 # Función principal de la aplicación Streamlit
 def main():
     # Sidebar con información
@@ -493,7 +1748,7 @@ def main():
         st.markdown("Desarrollado con Streamlit")
     
     # Crear pestañas para las diferentes secciones
-    tab1, tab2, tab3, tab4, tab5 = st.tabs(["Cargar Archivos", "Excel", "Factura", "Comparativa", "Discrepancias"])
+    tab1, tab2, tab3, tab4, tab5, tab6, tab7 = st.tabs(["Cargar Archivos", "Excel", "Factura", "Comparativa", "Discrepancias", "Revisiones", "Historial"])
     
     # Pestaña 1: Cargar Archivos
     with tab1:
@@ -513,6 +1768,11 @@ def main():
             if pdf_file:
                 st.success(f"Archivo PDF cargado: {pdf_file.name}")
         
+        numero_factura = st.text_input(
+            "Número de factura (opcional)",
+            help="Si se indica, una nueva comparación con el mismo número sustituye a las anteriores en el historial (facturas reemitidas)."
+        ).strip()
+        
         st.markdown("<br>", unsafe_allow_html=True)
         
         # Botón para iniciar la comparación
@@ -529,7 +1789,16 @@ def main():
                 progress_bar.progress(10)
                 
                 # Crear instancia del comparador
-                comparador = ComparadorMuestras(excel_file, pdf_file)
+                comparador = ComparadorMuestras(excel_file, pdf_file, cache_paginas=_obtener_cache_paginas())
+                
+                # Validación rápida antes del procesamiento completo
+                status_text.text("Validando archivos...")
+                veredicto = comparador.validar_preflight()
+                if not veredicto['valido']:
+                    for error in veredicto['errores']:
+                        st.error(error)
+                    st.error("Los archivos no superan la validación previa. Verifique que ha cargado el Excel y la factura correctos.")
+                    return
                 
                 # Procesar Excel
                 status_text.text("Procesando archivo Excel...")
@@ -566,6 +1835,18 @@ def main():
                 st.session_state.pdf_data = comparador.pdf_data
                 st.session_state.resultados = comparador.resultados_comparacion
                 st.session_state.estadisticas = estadisticas
+                st.session_state.nombres_archivos = (excel_file.name, pdf_file.name)
+                
+                # Guardar la comparación en el historial
+                try:
+                    hash_contenido = _hash_par(hashlib.sha256(excel_file.getvalue()).hexdigest(),
+                                               hashlib.sha256(pdf_file.getvalue()).hexdigest())
+                    _obtener_historial().registrar(excel_file.name, pdf_file.name,
+                                                   estadisticas, comparador.resultados_comparacion,
+                                                   factura=numero_factura or None,
+                                                   hash_contenido=hash_contenido)
+                except sqlite3.Error as e:
+                    st.warning(f"No se pudo guardar la comparación en el historial: {str(e)}")
                 
                 # Mostrar resumen
                 st.markdown("<h3 class='sub-header'>Resumen de Resultados</h3>", unsafe_allow_html=True)
@@ -779,8 +2060,148 @@ def main():
         else:
             st.info("Cargue los archivos y realice la comparación para ver las discrepancias.")
     
+    # Pestaña 6: Revisiones
+    with tab6:
+        st.markdown("<h2 class='sub-header'>Revisiones de Factura</h2>", unsafe_allow_html=True)
+        
+        # Exportar la ejecución actual para compararla con futuras revisiones
+        if 'resultados' in st.session_state:
+            excel_nombre, pdf_nombre = st.session_state.nombres_archivos
+            documento = serializar_resultados(excel_nombre, pdf_nombre,
+                                              st.session_state.estadisticas, st.session_state.resultados)
+            st.download_button(
+                label="Descargar resultados de esta comparación (JSON)",
+                data=json.dumps(documento, ensure_ascii=False, default=str).encode('utf-8'),
+                file_name=f"resultados_{Path(pdf_nombre).stem}.json",
+                mime='application/json',
+            )
+        
+        st.markdown("### Comparar con una ejecución anterior")
+        col1, col2 = st.columns(2)
+        with col1:
+            json_anterior = st.file_uploader("Resultados anteriores (JSON)", type=['json'], key='json_anterior')
+        with col2:
+            json_actual = st.file_uploader("Resultados nuevos (JSON, opcional: por defecto la comparación actual)",
+                                           type=['json'], key='json_actual')
+        
+        if json_anterior and (json_actual or 'resultados' in st.session_state):
+            try:
+                _rebobinar(json_anterior)
+                _rebobinar(json_actual)
+                anteriores = cargar_resultados(json_anterior)
+                actuales = cargar_resultados(json_actual) if json_actual else st.session_state.resultados
+                # Categorías o elementos con otra estructura fallan con TypeError/AttributeError
+                diferencias = diferenciar_resultados(anteriores, actuales)
+            except (ValueError, KeyError, TypeError, AttributeError) as e:
+                st.error(f"El archivo JSON no contiene resultados de comparación válidos: {str(e)}")
+            else:
+                
+                # Resumen por categoría
+                resumen_data = []
+                for categoria, etiqueta in ETIQUETAS_CATEGORIAS.items():
+                    resumen_data.append({
+                        'Categoría': etiqueta,
+                        'Añadidas': len(diferencias[categoria]['añadidas']),
+                        'Eliminadas': len(diferencias[categoria]['eliminadas'])
+                    })
+                st.dataframe(pd.DataFrame(resumen_data), use_container_width=True)
+                
+                # Detalle de cambios
+                cambios_data = []
+                for categoria, etiqueta in ETIQUETAS_CATEGORIAS.items():
+                    for cambio in ('añadidas', 'eliminadas'):
+                        for item in diferencias[categoria][cambio]:
+                            registro = _registro_resultado(item)
+                            cambios_data.append({
+                                'Categoría': etiqueta,
+                                'Cambio': 'Añadida' if cambio == 'añadidas' else 'Eliminada',
+                                'Muestra': registro.get('muestra', ''),
+                                'Código Eix': registro.get('codiEix', ''),
+                                'Análisis': registro.get('analisis', '')
+                            })
+                
+                if cambios_data:
+                    df_cambios = pd.DataFrame(cambios_data)
+                    st.dataframe(df_cambios, use_container_width=True)
+                    
+                    # Opción para descargar
+                    csv = df_cambios.to_csv(index=False).encode('utf-8')
+                    st.download_button(
+                        label="Descargar cambios entre ejecuciones como CSV",
+                        data=csv,
+                        file_name='cambios_revision.csv',
+                        mime='text/csv',
+                    )
+                else:
+                    st.success("No hay cambios entre ambas ejecuciones.")
+        else:
+            st.info("Cargue los resultados JSON de una ejecución anterior para ver qué ha cambiado en la revisión de la factura.")
+    
+    # Pestaña 7: Historial
+    with tab7:
+        st.markdown("<h2 class='sub-header'>Historial de Comparaciones</h2>", unsafe_allow_html=True)
+        
+        historial = _obtener_historial()
+        ejecuciones = historial.ejecuciones()
+        
+        if ejecuciones:
+            # Tasa de discrepancias agregada
+            st.markdown("<h3>Tasa de discrepancias</h3>", unsafe_allow_html=True)
+            
+            agrupaciones = {'Mes': 'mes', 'Instalación': 'instalacion', 'Código Eix': 'codiEix', 'Factura': 'factura'}
+            col1, col2, col3 = st.columns(3)
+            with col1:
+                agrupar_por = st.selectbox("Agrupar por", list(agrupaciones))
+            with col2:
+                desde = st.date_input("Desde", value=None)
+            with col3:
+                hasta = st.date_input("Hasta", value=None)
+            
+            tasas = historial.tasa_discrepancias(agrupaciones[agrupar_por], desde=desde, hasta=hasta)
+            if tasas:
+                df_tasas = pd.DataFrame([{
+                    agrupar_por: t['grupo'],
+                    'Líneas': t['lineas'],
+                    'Discrepancias': t['discrepancias'],
+                    'Tasa (%)': round(t['tasa'] * 100, 2)
+                } for t in tasas])
+                st.bar_chart(df_tasas.set_index(agrupar_por)['Tasa (%)'])
+                st.dataframe(df_tasas, use_container_width=True)
+                
+                # Opción para descargar
+                csv = df_tasas.to_csv(index=False).encode('utf-8')
+                st.download_button(
+                    label="Descargar tasas de discrepancias como CSV",
+                    data=csv,
+                    file_name='tasas_discrepancias.csv',
+                    mime='text/csv',
+                )
+            else:
+                st.warning("No hay comparaciones en el periodo seleccionado.")
+            
+            # Últimas ejecuciones
+            st.markdown("<h3>Últimas comparaciones</h3>", unsafe_allow_html=True)
+            df_ejecuciones = pd.DataFrame([{
+                'Fecha': e['fecha'],
+                'Factura': e['factura'],
+                'Excel': e['excel'],
+                'Coincidencias': e['total_coincidencias'],
+                'Parciales': e['total_parciales'],
+                'No facturadas': e['total_excel_no_factura'],
+                'No en Excel': e['total_factura_no_excel'],
+                'Duplicadas': e['total_duplicados'],
+                'Estado': e['estado'],
+                'Vigente': 'Sí' if e['vigente'] else 'No (revisada)'
+            } for e in ejecuciones])
+            st.dataframe(df_ejecuciones, use_container_width=True)
+        else:
+            st.info("Todavía no hay comparaciones guardadas en el historial.")
+    
     # Pie de página
     st.markdown("<div class='footer'>© 2025 BRAUT EIX AMBIENTAL - Comparador de Muestras v1.0</div>", unsafe_allow_html=True)
 
 if __name__ == "__main__":
-    main()
+    if '--vigilar' in sys.argv:
+        _ejecutar_daemon(sys.argv[1:])
+    else:
+        main()
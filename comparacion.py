@@ -0,0 +1,143 @@
+# Comparación de muestras por particiones.
+# Vive en un módulo importable para que las funciones se envíen al pool por
+# referencia a este módulo: Streamlit sustituye sys.modules['__main__'] en cada
+# rerun y las funciones definidas en app.py no se pueden serializar de forma fiable.
+# Los procesos hijos (spawn) sí vuelven a ejecutar app.py como __mp_main__ al
+# arrancar, con sus importaciones y llamadas a Streamlit, así que el pool se crea
+# una sola vez por proceso y se reutiliza entre comparaciones y sesiones.
+import difflib
+import multiprocessing
+import threading
+import zlib
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+
+# Pool compartido, creado bajo demanda
+_pool = None
+_pool_procesos = 0
+_pool_lock = threading.Lock()
+
+def obtener_pool(n_procesos):
+    """
+    Devuelve el pool de procesos compartido, creándolo la primera vez o si
+    cambia el número de procesos.
+
+    Args:
+        n_procesos (int): Número de procesos del pool
+
+    Returns:
+        ProcessPoolExecutor: Pool de procesos (contexto spawn)
+    """
+    global _pool, _pool_procesos
+    with _pool_lock:
+        if _pool is None or _pool_procesos != n_procesos:
+            if _pool is not None:
+                # Los trabajos ya enviados terminan antes de cerrar el pool anterior
+                _pool.shutdown(wait=False)
+            # spawn: no se duplica el proceso multihilo del servidor de Streamlit
+            _pool = ProcessPoolExecutor(max_workers=n_procesos, mp_context=multiprocessing.get_context('spawn'))
+            _pool_procesos = n_procesos
+        return _pool
+
+def descartar_pool(pool):
+    """
+    Descarta el pool compartido tras un fallo, para que la siguiente llamada cree uno nuevo.
+
+    Args:
+        pool (ProcessPoolExecutor): Pool que ha fallado
+    """
+    global _pool, _pool_procesos
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+            _pool_procesos = 0
+    pool.shutdown(wait=False, cancel_futures=True)
+
+def comparar_analisis(analisis_excel, analisis_pdf):
+    """
+    Compara descripciones de análisis para determinar si son equivalentes.
+    
+    Args:
+        analisis_excel (str): Descripción del análisis en el Excel
+        analisis_pdf (str): Descripción del análisis en el PDF
+    
+    Returns:
+        bool: True si los análisis son equivalentes, False en caso contrario
+    """
+    if not analisis_excel or not analisis_pdf:
+        return False
+
+    # Normalizar textos
+    analisis_excel = analisis_excel.lower()
+    analisis_pdf = analisis_pdf.lower()
+
+    # Verificar si uno contiene al otro
+    if analisis_excel in analisis_pdf or analisis_pdf in analisis_excel:
+        return True
+
+    # Calcular similitud
+    similarity = difflib.SequenceMatcher(None, analisis_excel, analisis_pdf).ratio()
+
+    # Si la similitud es alta, considerar equivalentes
+    return similarity > 0.7
+
+def particion_muestra(muestra_norm, n_particiones):
+    """
+    Partición de una muestra normalizada. Usa CRC32 para que el reparto sea
+    estable entre procesos y ejecuciones.
+
+    Args:
+        muestra_norm (str): Código de muestra normalizado
+        n_particiones (int): Número de particiones
+
+    Returns:
+        int: Índice de partición
+    """
+    return zlib.crc32(str(muestra_norm).encode('utf-8')) % n_particiones
+
+def comparar_particion(excel_part, pdf_part):
+    """
+    Compara las muestras de una partición. Todas las líneas de una misma
+    muestra caen en la misma partición, por lo que el resultado es idéntico
+    al de comparar el conjunto completo.
+
+    Args:
+        excel_part (list): Tuplas (posición, muestra_norm, codiEix, analisis) del Excel
+        pdf_part (list): Tuplas (posición, muestra_norm, codiEix, analisis) de la factura
+
+    Returns:
+        tuple: (lista de (categoría, posición PDF, posición Excel o None),
+                lista de posiciones del Excel no facturadas)
+    """
+    # Crear diccionarios para facilitar la búsqueda
+    excel_dict = {m[1]: m for m in excel_part}
+    
+    # Identificar muestras duplicadas en la factura
+    conteo_pdf = Counter(m[1] for m in pdf_part)
+    
+    clasificadas = []
+    pdf_procesadas = set()
+    for pdf_idx, muestra_norm, codiEix, analisis in pdf_part:
+        # Verificar si es un duplicado
+        if conteo_pdf[muestra_norm] > 1 and muestra_norm in pdf_procesadas:
+            clasificadas.append(('duplicados_factura', pdf_idx, None))
+            continue
+        
+        pdf_procesadas.add(muestra_norm)
+        
+        # Verificar si la muestra está en el Excel
+        if muestra_norm in excel_dict:
+            excel_idx, _, excel_codiEix, excel_analisis = excel_dict[muestra_norm]
+            
+            # Coincidencia completa si coinciden código Eix y análisis
+            analisis_coincide = comparar_analisis(excel_analisis, analisis)
+            coincidencia_completa = excel_codiEix == codiEix and analisis_coincide
+            categoria = 'coincidencias' if coincidencia_completa else 'coincidencias_parciales'
+            clasificadas.append((categoria, pdf_idx, excel_idx))
+        else:
+            clasificadas.append(('factura_no_excel', pdf_idx, None))
+    
+    # Identificar muestras del Excel que no están en la factura
+    no_facturadas = [m[0] for m in excel_part if m[1] not in conteo_pdf]
+    
+    return clasificadas, no_facturadas
@@ -0,0 +1,142 @@
+import io
+import os
+import sys
+import time
+
+import pytest
+
+pytest.importorskip("streamlit")
+PyPDF2 = pytest.importorskip("PyPDF2")
+from PyPDF2 import PageObject, PdfWriter
+from PyPDF2.generic import ArrayObject, DecodedStreamObject, DictionaryObject, NameObject, NumberObject
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import app
+
+
+def _pdf_multiflujo(flujos_por_pagina):
+    """Genera un PDF cuyas páginas tienen /Contents como array de flujos."""
+    writer = PdfWriter()
+    for flujos in flujos_por_pagina:
+        page = PageObject.create_blank_page(None, 612, 792)
+        fuente = DictionaryObject({
+            NameObject('/Type'): NameObject('/Font'),
+            NameObject('/Subtype'): NameObject('/Type1'),
+            NameObject('/BaseFont'): NameObject('/Helvetica'),
+        })
+        page[NameObject('/Resources')] = DictionaryObject({
+            NameObject('/Font'): DictionaryObject({NameObject('/F1'): writer._add_object(fuente)})
+        })
+        referencias = []
+        for datos in flujos:
+            flujo = DecodedStreamObject()
+            flujo.set_data(datos)
+            referencias.append(writer._add_object(flujo))
+        page[NameObject('/Contents')] = ArrayObject(referencias)
+        writer.add_page(page)
+    salida = io.BytesIO()
+    writer.write(salida)
+    salida.seek(0)
+    return salida
+
+
+FLUJOS = [
+    b"BT /F1 12 Tf 72 720 Td (12345678 M-01-1000 Analisis pH) Tj ET",
+    b"BT /F1 12 Tf 72 700 Td (87654321 M-02-2000 Conductividad) Tj ET",
+]
+
+
+def test_pagina_con_array_de_flujos_usa_cache():
+    sin_cache = app.ComparadorMuestras(None, _pdf_multiflujo([FLUJOS]))
+    assert sin_cache.procesar_pdf()
+
+    cache = app.CachePaginasPDF()
+    con_cache = app.ComparadorMuestras(None, _pdf_multiflujo([FLUJOS]), cache_paginas=cache)
+    assert con_cache.procesar_pdf()
+    assert con_cache.pdf_data == sin_cache.pdf_data
+    assert [m['muestra'] for m in con_cache.pdf_data] == ['12345678', '87654321']
+
+    # La página queda indexada por el hash de todos sus flujos
+    hash_pagina, _ = con_cache._extraer_paginas_pdf()[0]
+    assert hash_pagina is not None
+    assert cache.obtener('texto', hash_pagina) is not None
+
+
+def test_cambio_en_un_flujo_cambia_el_hash():
+    modificado = [FLUJOS[0], FLUJOS[1].replace(b"87654321", b"87654322")]
+    comparador = app.ComparadorMuestras(None, _pdf_multiflujo([FLUJOS, modificado]),
+                                        cache_paginas=app.CachePaginasPDF())
+    (hash_original, _), (hash_modificado, texto) = comparador._extraer_paginas_pdf()
+    assert hash_original != hash_modificado
+    assert '87654322' in texto
+
+
+def _pdf_con_xobjects(textos):
+    """Genera un PDF cuyas páginas dibujan su texto a través de un Form XObject."""
+    writer = PdfWriter()
+    fuente = writer._add_object(DictionaryObject({
+        NameObject('/Type'): NameObject('/Font'),
+        NameObject('/Subtype'): NameObject('/Type1'),
+        NameObject('/BaseFont'): NameObject('/Helvetica'),
+    }))
+    for texto in textos:
+        formulario = DecodedStreamObject()
+        formulario.set_data(b"BT /F1 12 Tf 72 720 Td (" + texto + b") Tj ET")
+        formulario.update({
+            NameObject('/Type'): NameObject('/XObject'),
+            NameObject('/Subtype'): NameObject('/Form'),
+            NameObject('/BBox'): ArrayObject([NumberObject(0), NumberObject(0), NumberObject(612), NumberObject(792)]),
+            NameObject('/Resources'): DictionaryObject({
+                NameObject('/Font'): DictionaryObject({NameObject('/F1'): fuente})
+            }),
+        })
+        page = PageObject.create_blank_page(None, 612, 792)
+        page[NameObject('/Resources')] = DictionaryObject({
+            NameObject('/XObject'): DictionaryObject({NameObject('/X0'): writer._add_object(formulario)})
+        })
+        contenido = DecodedStreamObject()
+        contenido.set_data(b"q /X0 Do Q")
+        page[NameObject('/Contents')] = writer._add_object(contenido)
+        writer.add_page(page)
+    salida = io.BytesIO()
+    writer.write(salida)
+    salida.seek(0)
+    return salida
+
+
+def test_paginas_con_xobject_distinto_no_comparten_cache():
+    textos = [b"12345678 M-01-1000 Analisis pH", b"87654321 M-02-2000 Conductividad"]
+    sin_cache = app.ComparadorMuestras(None, _pdf_con_xobjects(textos))
+    assert sin_cache.procesar_pdf()
+
+    cache = app.CachePaginasPDF()
+    con_cache = app.ComparadorMuestras(None, _pdf_con_xobjects(textos), cache_paginas=cache)
+    assert con_cache.procesar_pdf()
+    assert [m['muestra'] for m in con_cache.pdf_data] == ['12345678', '87654321']
+    assert con_cache.pdf_data == sin_cache.pdf_data
+
+    # Un PDF distinto con el mismo contenido de página tampoco reutiliza textos ajenos
+    otro = app.ComparadorMuestras(None, _pdf_con_xobjects([b"11112222 M-03-3000 Metales"]), cache_paginas=cache)
+    assert otro.procesar_pdf()
+    assert [m['muestra'] for m in otro.pdf_data] == ['11112222']
+
+
+def test_limpiar_disco_elimina_solo_entradas_sin_usar(tmp_path):
+    cache = app.CachePaginasPDF(tmp_path)
+    cache.guardar('texto', 'aa11', 'usada')
+    cache.guardar('texto', 'bb22', 'olvidada')
+    hace_60_dias = time.time() - 60 * 86400
+    for clave in ('aa11', 'bb22'):
+        os.utime(cache._ruta('texto', clave), (hace_60_dias, hace_60_dias))
+    temporal = tmp_path / 'texto' / 'cc' / '.cc33.json1234.tmp'
+    temporal.parent.mkdir(parents=True)
+    temporal.write_text('{')
+    os.utime(temporal, (hace_60_dias, hace_60_dias))
+
+    # Una lectura desde disco renueva la fecha de último uso
+    assert app.CachePaginasPDF(tmp_path).obtener('texto', 'aa11') == 'usada'
+
+    assert cache.limpiar_disco(30) == 2
+    assert cache._ruta('texto', 'aa11').exists()
+    assert not cache._ruta('texto', 'bb22').exists()
+    assert not temporal.exists()